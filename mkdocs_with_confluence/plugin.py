@@ -1,5 +1,6 @@
 import time
 import os
+import gzip
 import hashlib
 import sys
 import re
@@ -8,7 +9,11 @@ import shutil
 import requests
 import mimetypes
 import mistune
+from urllib.parse import urljoin
 import contextlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 from mkdocs.config import config_options
 from mkdocs.plugins import BasePlugin
@@ -16,6 +21,11 @@ from md2cf.confluence_renderer import ConfluenceRenderer
 from os import environ
 
 TEMPLATE_BODY = "<p> TEMPLATE </p>"
+PAGE_LIMIT = 100
+ARCHIVE_LIMIT = 300
+CQL_TITLE_LIMIT = 50
+CLEANUP_WORKERS = 8
+HTTP_POOL_SIZE = 10
 
 
 @contextlib.contextmanager
@@ -31,8 +41,62 @@ class DummyFile(object):
         pass
 
 
+class ConfluenceClient(object):
+    def __init__(self, user, pw):
+        self.session = requests.Session()
+        self.session.auth = (user, pw)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.rate_limit = 0
+        self.last_request = 0
+        self.lock = threading.Lock()
+        self.page_caches = {}
+
+    def request(self, method, url, **kwargs):
+        if self.rate_limit:
+            with self.lock:
+                wait = self.last_request + 1.0 / self.rate_limit - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                self.last_request = time.time()
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def page_cache(self, space, main_parent):
+        # page ids and the index of the pages below the main parent, kept warm for later builds of the same site
+        with self.lock:
+            return self.page_caches.setdefault((space, main_parent), {"page_ids": {}, "page_index": None})
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(host_url, user, pw, rate_limit=0):
+    with _clients_lock:
+        key = (host_url, user, pw)
+        if key not in _clients:
+            _clients[key] = ConfluenceClient(user, pw)
+        client = _clients[key]
+        # sites sharing a client share its limit, so keep the strictest one any of them asked for
+        if rate_limit and (not client.rate_limit or rate_limit < client.rate_limit):
+            client.rate_limit = rate_limit
+        return client
+
+
 class MkdocsWithConfluence(BasePlugin):
-    _id = 0
     config_scheme = (
         ("host_url", config_options.Type(str, default=None)),
         ("space", config_options.Type(str, default=None)),
@@ -43,6 +107,12 @@ class MkdocsWithConfluence(BasePlugin):
         ("verbose", config_options.Type(bool, default=False)),
         ("debug", config_options.Type(bool, default=False)),
         ("dryrun", config_options.Type(bool, default=False)),
+        ("cleanup_orphans", config_options.Type(bool, default=False)),
+        ("cleanup_action", config_options.Choice(("delete", "archive"), default="delete")),
+        ("cleanup_max_deletions", config_options.Type(int, default=10)),
+        ("pipeline", config_options.Type(bool, default=False)),
+        ("pipeline_memory_budget", config_options.Type(int, default=64)),
+        ("rate_limit", config_options.Type(int, default=0)),
     )
 
     def __init__(self):
@@ -51,9 +121,34 @@ class MkdocsWithConfluence(BasePlugin):
         self.confluence_mistune = mistune.Markdown(renderer=self.confluence_renderer)
         self.simple_log = False
         self.flen = 1
+        self._id = 0
+        self.tab_nav = []
+        self.page_cache = {"page_ids": {}, "page_index": None}
+        self.kept_titles = set()
+        self.missing_titles = set()
+        self.spool = deque()
+        self.spool_size = 0
+        self.spool_count = 0
+        self.spool_dir = None
+        self.spool_cond = threading.Condition()
+        self.spool_closed = False
+        self.uploader = None
+        self.uploader_error = None
+
+    @property
+    def page_ids(self):
+        return self.page_cache["page_ids"]
+
+    @property
+    def page_index(self):
+        return self.page_cache["page_index"]
+
+    @page_index.setter
+    def page_index(self, page_index):
+        self.page_cache["page_index"] = page_index
 
     def on_nav(self, nav, config, files):
-        MkdocsWithConfluence.tab_nav = []
+        self.tab_nav = []
         navigation_items = nav.__repr__()
 
         for n in navigation_items.split("\n"):
@@ -75,7 +170,7 @@ class MkdocsWithConfluence(BasePlugin):
                     self.page_title = self.page_local_name
 
                 p = spaces + self.page_title
-                MkdocsWithConfluence.tab_nav.append(p)
+                self.tab_nav.append(p)
             if "Section" in n:
                 try:
                     self.section_title = self.__get_section_title(n)
@@ -91,7 +186,19 @@ class MkdocsWithConfluence(BasePlugin):
                     self.section_local_name = self.__get_section_title(n)
                     self.section_title = self.section_local_name
                 s = spaces + self.section_title
-                MkdocsWithConfluence.tab_nav.append(s)
+                self.tab_nav.append(s)
+
+        if self.enabled:
+            main_parent = self.config["parent_page_name"] or self.config["space"]
+            self.find_page_ids(list(self.get_nav_titles(nav.items)) + [main_parent])
+
+    def get_nav_titles(self, items):
+        for item in items:
+            # pages without a title in the nav only get one once their markdown is read, they are resolved later
+            if item.title:
+                yield item.title
+            if item.children:
+                yield from self.get_nav_titles(item.children)
 
     def on_files(self, files, config):
         pages = files.documentation_pages()
@@ -130,6 +237,7 @@ class MkdocsWithConfluence(BasePlugin):
                     "WARNING -  Mkdocs With Confluence: Exporting MKDOCS pages to Confluence turned OFF: "
                     f"(set environment variable {env_name} to 1 to enable)"
                 )
+                self.enabled = False
                 return
         else:
             print("INFO    -  Mkdocs With Confluence: Exporting MKDOCS pages to Confluence turned ON by default!")
@@ -141,19 +249,37 @@ class MkdocsWithConfluence(BasePlugin):
         else:
             self.dryrun = False
 
+        self.pw = self.config["password"]
+        self.user = self.config["username"]
+        self._id = 0
+        self.client = get_client(self.config["host_url"], self.user, self.pw, self.config["rate_limit"])
+        # the caches outlive the build, entries are revalidated when they are used since pages may have changed
+        main_parent = self.config["parent_page_name"] or self.config["space"]
+        self.page_cache = self.client.page_cache(self.config["space"], main_parent)
+        self.kept_titles = set()
+        self.missing_titles = set()
+        self.spool = deque()
+        self.spool_size = 0
+        self.spool_count = 0
+        self.spool_dir = None
+        self.spool_cond = threading.Condition()
+        self.spool_closed = False
+        self.uploader = None
+        self.uploader_error = None
+
     def on_page_markdown(self, markdown, page, config, files):
-        MkdocsWithConfluence._id += 1
+        self._id += 1
         self.pw = self.config["password"]
         self.user = self.config["username"]
 
         if self.enabled:
             if self.simple_log is True:
                 print("INFO    - Mkdocs With Confluence: Page export progress: [", end="", flush=True)
-                for i in range(MkdocsWithConfluence._id):
+                for i in range(self._id):
                     print("#", end="", flush=True)
-                for j in range(self.flen - MkdocsWithConfluence._id):
+                for j in range(self.flen - self._id):
                     print("-", end="", flush=True)
-                print(f"] ({MkdocsWithConfluence._id} / {self.flen})", end="\r", flush=True)
+                print(f"] ({self._id} / {self.flen})", end="\r", flush=True)
 
             if self.config["debug"]:
                 print(f"\nDEBUG    - Handling Page '{page.title}' (And Parent Nav Pages if necessary):\n")
@@ -209,9 +335,6 @@ class MkdocsWithConfluence(BasePlugin):
                 if self.config["debug"]:
                     print(f"DEBUG    - PARENT0: {parent}, PARENT1: {parent1}, MAIN PARENT: {main_parent}")
 
-                tf = tempfile.NamedTemporaryFile(delete=False)
-                f = open(tf.name, "w")
-
                 attachments = []
                 try:
                     for match in re.finditer(r'img src="file://(.*)" s', markdown):
@@ -230,13 +353,17 @@ class MkdocsWithConfluence(BasePlugin):
                 )
                 new_markdown = re.sub(r'" style="page-break-inside: avoid;">', '"/></ac:image></p>', new_markdown)
                 confluence_body = self.confluence_mistune(new_markdown)
-                f.write(confluence_body)
                 if self.config["debug"]:
                     print(confluence_body)
-                page_name = page.title
-                new_name = "confluence_page_" + page_name.replace(" ", "_") + ".html"
-                shutil.copy(f.name, new_name)
-                f.close()
+                if not self.config["pipeline"]:
+                    # the pipeline keeps rendered pages in its own spool, no copies are left behind
+                    tf = tempfile.NamedTemporaryFile(delete=False)
+                    f = open(tf.name, "w")
+                    f.write(confluence_body)
+                    page_name = page.title
+                    new_name = "confluence_page_" + page_name.replace(" ", "_") + ".html"
+                    shutil.copy(f.name, new_name)
+                    f.close()
 
                 if self.config["debug"]:
                     print(
@@ -248,114 +375,277 @@ class MkdocsWithConfluence(BasePlugin):
                         f"DEBUG    - BODY: {confluence_body}\n"
                     )
 
-                page_id = self.find_page_id(page.title)
-                if page_id is not None:
-                    if self.config["debug"]:
-                        print(
-                            f"DEBUG    - JUST ONE STEP FROM UPDATE OF PAGE '{page.title}' \n"
-                            f"DEBUG    - CHECKING IF PARENT PAGE ON CONFLUENCE IS THE SAME AS HERE"
-                        )
+                ancestors = [ancestor.title for ancestor in page.ancestors]
+                if self.config["pipeline"]:
+                    self.spool_page(page.title, parent, parent1, main_parent, confluence_body, attachments, ancestors)
+                else:
+                    self.publish_page(page.title, parent, parent1, main_parent, confluence_body, attachments, ancestors)
 
-                    parent_name = self.find_parent_name_of_page(page.title)
+            except IndexError as e:
+                if self.config["debug"]:
+                    print(f"DEBUG    - ERR({e}): Exception error!")
+                return markdown
+
+        return markdown
+
+    def on_page_content(self, html, page, config, files):
+        return html
+
+    def publish_page(self, page_title, parent, parent1, main_parent, confluence_body, attachments, ancestors=()):
+        # everything this page needs on Confluence is kept by the orphan cleanup, even if publishing fails
+        self.kept_titles.update([page_title, parent, parent1, *ancestors])
+        self.move_sections_if_needed(ancestors, main_parent)
+
+        page_id = self.find_page_id(page_title)
+        if page_id is not None:
+            # also refreshes the cached id and parent, the page may have been removed or moved since it was cached
+            page_version = self.find_page_version(page_title)
+            if page_version is None:
+                page_id = None
+        if page_id is not None:
+            if self.config["debug"]:
+                print(
+                    f"DEBUG    - JUST ONE STEP FROM UPDATE OF PAGE '{page_title}' \n"
+                    f"DEBUG    - CHECKING IF PARENT PAGE ON CONFLUENCE IS THE SAME AS HERE"
+                )
+
+            parent_name = self.find_parent_name_of_page(page_title)
+
+            if parent_name == parent:
+                if self.config["debug"]:
+                    print("DEBUG    - Parents match. Continue...")
+                self.update_page(page_title, confluence_body, page_version=page_version)
+            else:
+                if self.config["debug"]:
+                    print(f"DEBUG    - Parents does not match: '{parent}' =/= '{parent_name}' Moving page...")
+                if self.find_page_id(parent) is None:
+                    second_parent_id = self.find_page_id(parent1)
+                    if not second_parent_id:
+                        print(f"ERR: PARENT '{parent1}' OF MOVED PAGE '{page_title}' UNKNOWN. ABORTING!")
+                        return
+                    body = TEMPLATE_BODY.replace("TEMPLATE", parent)
+                    self.add_page(parent, second_parent_id, body)
+                    time.sleep(1)
+                self.update_page(page_title, confluence_body, parent, page_version)
+            for i in self.tab_nav:
+                if page_title in i:
+                    n_kol = len(i + " *NEW PAGE*")
+                    print(f"INFO    - Mkdocs With Confluence: {i} *UPDATE*")
+        else:
+            if self.config["debug"]:
+                print(
+                    f"DEBUG    - PAGE: {page_title}, PARENT0: {parent}, "
+                    f"PARENT1: {parent1}, MAIN PARENT: {main_parent}"
+                )
+            parent_id = self.find_page_id(parent)
+            self.wait_until(parent_id, 1, 20)
+            second_parent_id = self.find_page_id(parent1)
+            self.wait_until(second_parent_id, 1, 20)
+            main_parent_id = self.find_page_id(main_parent)
+            if not parent_id:
+                if not second_parent_id:
+                    main_parent_id = self.find_page_id(main_parent)
+                    if not main_parent_id:
+                        print("ERR: MAIN PARENT UNKNOWN. ABORTING!")
+                        return
 
-                    if parent_name == parent:
-                        if self.config["debug"]:
-                            print("DEBUG    - Parents match. Continue...")
-                    else:
-                        if self.config["debug"]:
-                            print(f"DEBUG    - ERR, Parents does not match: '{parent}' =/= '{parent_name}' Aborting...")
-                        return markdown
-                    self.update_page(page.title, confluence_body)
-                    for i in MkdocsWithConfluence.tab_nav:
-                        if page.title in i:
-                            n_kol = len(i + " *NEW PAGE*")
-                            print(f"INFO    - Mkdocs With Confluence: {i} *UPDATE*")
-                else:
                     if self.config["debug"]:
                         print(
-                            f"DEBUG    - PAGE: {page.title}, PARENT0: {parent}, "
-                            f"PARENT1: {parent1}, MAIN PARENT: {main_parent}"
+                            f"DEBUG    - Trying to ADD page '{parent1}' to "
+                            f"main parent({main_parent}) ID: {main_parent_id}"
                         )
-                    parent_id = self.find_page_id(parent)
-                    self.wait_until(parent_id, 1, 20)
-                    second_parent_id = self.find_page_id(parent1)
-                    self.wait_until(second_parent_id, 1, 20)
-                    main_parent_id = self.find_page_id(main_parent)
-                    if not parent_id:
-                        if not second_parent_id:
-                            main_parent_id = self.find_page_id(main_parent)
-                            if not main_parent_id:
-                                print("ERR: MAIN PARENT UNKNOWN. ABORTING!")
-                                return markdown
-
-                            if self.config["debug"]:
-                                print(
-                                    f"DEBUG    - Trying to ADD page '{parent1}' to "
-                                    f"main parent({main_parent}) ID: {main_parent_id}"
-                                )
-                            body = TEMPLATE_BODY.replace("TEMPLATE", parent1)
-                            self.add_page(parent1, main_parent_id, body)
-                            for i in MkdocsWithConfluence.tab_nav:
-                                if parent1 in i:
-                                    n_kol = len(i + "INFO    - Mkdocs With Confluence:" + " *NEW PAGE*")
-                                    print(f"INFO    - Mkdocs With Confluence: {i} *NEW PAGE*")
-                            time.sleep(1)
+                    body = TEMPLATE_BODY.replace("TEMPLATE", parent1)
+                    self.add_page(parent1, main_parent_id, body)
+                    for i in self.tab_nav:
+                        if parent1 in i:
+                            n_kol = len(i + "INFO    - Mkdocs With Confluence:" + " *NEW PAGE*")
+                            print(f"INFO    - Mkdocs With Confluence: {i} *NEW PAGE*")
+                    time.sleep(1)
 
-                        if self.config["debug"]:
+                if self.config["debug"]:
+                    print(f"DEBUG    - Trying to ADD page '{parent}' " f"to parent1({parent1}) ID: {second_parent_id}")
+                body = TEMPLATE_BODY.replace("TEMPLATE", parent)
+                self.add_page(parent, second_parent_id, body)
+                for i in self.tab_nav:
+                    if parent in i:
+                        n_kol = len(i + "INFO    - Mkdocs With Confluence:" + " *NEW PAGE*")
+                        print(f"INFO    - Mkdocs With Confluence: {i} *NEW PAGE*")
+                time.sleep(1)
+
+            # if self.config['debug']:
+
+            if parent_id is None:
+                for i in range(11):
+                    while parent_id is None:
+                        try:
+                            self.add_page(page_title, parent_id, confluence_body)
+                        except requests.exceptions.HTTPError:
                             print(
-                                f"DEBUG    - Trying to ADD page '{parent}' "
-                                f"to parent1({parent1}) ID: {second_parent_id}"
+                                f"ERR    - HTTP error on adding page. It probably occured due to "
+                                f"parent ID('{parent_id}') page is not YET synced on server. Retry nb {i}/10..."
                             )
-                        body = TEMPLATE_BODY.replace("TEMPLATE", parent)
-                        self.add_page(parent, second_parent_id, body)
-                        for i in MkdocsWithConfluence.tab_nav:
-                            if parent in i:
-                                n_kol = len(i + "INFO    - Mkdocs With Confluence:" + " *NEW PAGE*")
-                                print(f"INFO    - Mkdocs With Confluence: {i} *NEW PAGE*")
-                        time.sleep(1)
-
-                    # if self.config['debug']:
-
-                    if parent_id is None:
-                        for i in range(11):
-                            while parent_id is None:
-                                try:
-                                    self.add_page(page.title, parent_id, confluence_body)
-                                except requests.exceptions.HTTPError:
-                                    print(
-                                        f"ERR    - HTTP error on adding page. It probably occured due to "
-                                        f"parent ID('{parent_id}') page is not YET synced on server. Retry nb {i}/10..."
-                                    )
-                                    sleep(5)
-                                    parent_id = self.find_page_id(parent)
-                                break
-
-                    self.add_page(page.title, parent_id, confluence_body)
-
-                    print(f"Trying to ADD page '{page.title}' to parent0({parent}) ID: {parent_id}")
-                    for i in MkdocsWithConfluence.tab_nav:
-                        if page.title in i:
-                            n_kol = len(i + "INFO    - Mkdocs With Confluence:" + " *NEW PAGE*")
-                            print(f"INFO    - Mkdocs With Confluence: {i} *NEW PAGE*")
+                            sleep(5)
+                            parent_id = self.find_page_id(parent)
+                        break
 
-                if attachments:
-                    if self.config["debug"]:
-                        print(f"\nDEBUG    - UPLOADING ATTACHMENTS TO CONFLUENCE, DETAILS:\n" f"FILES: {attachments}\n")
+            self.add_page(page_title, parent_id, confluence_body)
 
-                    n_kol = len("  *NEW ATTACHMENTS({len(attachments)})*")
-                    print(f"\033[A\033[F\033[{n_kol}G  *NEW ATTACHMENTS({len(attachments)})*")
-                    for f in attachments:
-                        self.add_or_update_attachment(page.title, f)
+            print(f"Trying to ADD page '{page_title}' to parent0({parent}) ID: {parent_id}")
+            for i in self.tab_nav:
+                if page_title in i:
+                    n_kol = len(i + "INFO    - Mkdocs With Confluence:" + " *NEW PAGE*")
+                    print(f"INFO    - Mkdocs With Confluence: {i} *NEW PAGE*")
 
+        if attachments:
+            if self.config["debug"]:
+                print(f"\nDEBUG    - UPLOADING ATTACHMENTS TO CONFLUENCE, DETAILS:\n" f"FILES: {attachments}\n")
+
+            n_kol = len("  *NEW ATTACHMENTS({len(attachments)})*")
+            print(f"\033[A\033[F\033[{n_kol}G  *NEW ATTACHMENTS({len(attachments)})*")
+            for f in attachments:
+                self.add_or_update_attachment(page_title, f)
+
+    def on_post_build(self, config):
+        if self.enabled and self.config["pipeline"]:
+            self.finish_spool()
+        if self.enabled and self.config["cleanup_orphans"]:
+            self.cleanup_orphans()
+
+    def on_build_error(self, error):
+        if self.enabled and self.config["pipeline"]:
+            self.finish_spool(discard=True)
+
+    def spool_page(self, page_title, parent, parent1, main_parent, confluence_body, attachments, ancestors=()):
+        if self.uploader_error is not None:
+            # the uploader has stopped, fail the build now rather than spooling pages that are never published
+            raise self.uploader_error
+        entry = {
+            "title": page_title,
+            "parent": parent,
+            "parent1": parent1,
+            "main_parent": main_parent,
+            "attachments": attachments,
+            "ancestors": ancestors,
+        }
+        data = confluence_body.encode("utf-8")
+        entry["size"] = len(data)
+        with self.spool_cond:
+            in_memory = self.spool_size + entry["size"] <= self.config["pipeline_memory_budget"] * 1024 * 1024
+            if in_memory:
+                self.spool_size += entry["size"]
+        if in_memory:
+            entry["body"] = confluence_body
+        else:
+            if self.spool_dir is None:
+                self.spool_dir = tempfile.mkdtemp(prefix="mkdocs-with-confluence-")
+            entry["body_path"] = os.path.join(self.spool_dir, f"{self.spool_count}.html.gz")
+            with gzip.open(entry["body_path"], "wb") as f:
+                f.write(data)
+        del data
+        self.spool_count += 1
+        if self.config["debug"]:
+            where = "memory" if in_memory else "disk"
+            print(f"DEBUG    - Spooled page '{page_title}' ({entry['size']} bytes, {where})")
+        with self.spool_cond:
+            self.spool.append(entry)
+            self.spool_cond.notify()
+        if self.uploader is None:
+            self.uploader = threading.Thread(target=self.run_uploader, daemon=True)
+            self.uploader.start()
+
+    def run_uploader(self):
+        try:
+            self.publish_spool()
+        except Exception as e:
+            # re-raised from finish_spool, in the build's own thread
+            self.uploader_error = e
+
+    def publish_spool(self):
+        # uploads pages in nav order while the rest of the site is still rendering
+        while True:
+            with self.spool_cond:
+                while not self.spool and not self.spool_closed:
+                    self.spool_cond.wait()
+                if not self.spool:
+                    return
+                entry = self.spool.popleft()
+            if "body_path" in entry:
+                with gzip.open(entry["body_path"], "rb") as f:
+                    confluence_body = f.read().decode("utf-8")
+                os.remove(entry["body_path"])
+            else:
+                confluence_body = entry.pop("body")
+            try:
+                self.publish_page(
+                    entry["title"],
+                    entry["parent"],
+                    entry["parent1"],
+                    entry["main_parent"],
+                    confluence_body,
+                    entry["attachments"],
+                    entry["ancestors"],
+                )
             except IndexError as e:
                 if self.config["debug"]:
                     print(f"DEBUG    - ERR({e}): Exception error!")
-                return markdown
-
-        return markdown
-
-    def on_page_content(self, html, page, config, files):
-        return html
+            finally:
+                if "body_path" not in entry:
+                    with self.spool_cond:
+                        self.spool_size -= entry["size"]
+
+    def finish_spool(self, discard=False):
+        with self.spool_cond:
+            self.spool_closed = True
+            if discard:
+                self.spool.clear()
+                self.spool_size = 0
+            self.spool_cond.notify_all()
+        try:
+            if self.uploader is not None:
+                if not discard:
+                    print("INFO    - Mkdocs With Confluence: Publishing the remaining spooled pages...")
+                self.uploader.join()
+                self.uploader = None
+        finally:
+            if self.spool_dir is not None:
+                shutil.rmtree(self.spool_dir, ignore_errors=True)
+                self.spool_dir = None
+        if self.uploader_error is not None and not discard:
+            raise self.uploader_error
+
+    def cleanup_orphans(self):
+        if not self.kept_titles:
+            print("ERR    - Mkdocs With Confluence: No pages were published in this build. Skipping orphan cleanup")
+            return
+        self.page_index = None
+        orphans = {
+            title: entry["id"] for title, entry in self.get_page_index().items() if title not in self.kept_titles
+        }
+        if not orphans:
+            print("INFO    - Mkdocs With Confluence: No orphaned pages found")
+            return
+        action = self.config["cleanup_action"]
+        max_deletions = self.config["cleanup_max_deletions"]
+        if len(orphans) > max_deletions:
+            print(
+                f"ERR    - Mkdocs With Confluence: {len(orphans)} orphaned pages found, more than "
+                f"cleanup_max_deletions ({max_deletions}). Skipping {action} of:"
+            )
+            for title in sorted(orphans):
+                print(f"ERR    -   * {title}")
+            return
+        for title in sorted(orphans):
+            print(f"INFO    - Mkdocs With Confluence: {title} *ORPHAN* ({action})")
+        if self.dryrun:
+            return
+        if action == "archive":
+            self.archive_pages(list(orphans.values()))
+        else:
+            with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+                list(executor.map(self.delete_page, orphans.values()))
+        for title in orphans:
+            del self.page_index[title]
+            self.page_ids.pop(title, None)
 
     def __get_page_url(self, section):
         return re.search("url='(.*)'\\)", section).group(1)[:-1] + ".md"
@@ -428,9 +718,8 @@ class MkdocsWithConfluence(BasePlugin):
         headers = {"X-Atlassian-Token": "no-check"}  # no content-type here!
         if self.config["debug"]:
             print(f"URL: {url}")
-        auth = (self.user, self.pw)
 
-        r = requests.get(url, headers=headers, params={"filename": name, "expand": "version"}, auth=auth)
+        r = self.client.get(url, headers=headers, params={"filename": name, "expand": "version"})
         r.raise_for_status()
         with nostdout():
             response_json = r.json()
@@ -446,7 +735,6 @@ class MkdocsWithConfluence(BasePlugin):
         if self.config["debug"]:
             print(f"URL: {url}")
         filename = filepath
-        auth = (self.user, self.pw)
 
         # determine content-type
         content_type, encoding = mimetypes.guess_type(filename)
@@ -455,7 +743,7 @@ class MkdocsWithConfluence(BasePlugin):
         files = {"file": (filename, open(filename, "rb"), content_type), "comment": message}
 
         if not self.dryrun:
-            r = requests.post(url, headers=headers, files=files, auth=auth)
+            r = self.client.post(url, headers=headers, files=files)
             r.raise_for_status()
             print(r.json())
             if r.status_code == 200:
@@ -472,7 +760,6 @@ class MkdocsWithConfluence(BasePlugin):
         if self.config["debug"]:
             print(f"URL: {url}")
         filename = filepath
-        auth = (self.user, self.pw)
 
         # determine content-type
         content_type, encoding = mimetypes.guess_type(filename)
@@ -481,7 +768,7 @@ class MkdocsWithConfluence(BasePlugin):
         files = {"file": (filename, open(filename, "rb"), content_type), "comment": message}
 
         if not self.dryrun:
-            r = requests.post(url, headers=headers, files=files, auth=auth)
+            r = self.client.post(url, headers=headers, files=files)
             print(r.json())
             r.raise_for_status()
             if r.status_code == 200:
@@ -492,24 +779,73 @@ class MkdocsWithConfluence(BasePlugin):
     def find_page_id(self, page_name):
         if self.config["debug"]:
             print(f"INFO    -   * Mkdocs With Confluence: Find Page ID: PAGE NAME: {page_name}")
-        name_confl = page_name.replace(" ", "+")
-        url = self.config["host_url"] + "?title=" + name_confl + "&spaceKey=" + self.config["space"] + "&expand=history"
+        if page_name in self.page_ids:
+            return self.page_ids[page_name]
+        if page_name in self.missing_titles:
+            return None
+        url = self.config["host_url"]
+        params = {"title": page_name, "spaceKey": self.config["space"], "expand": "history"}
         if self.config["debug"]:
-            print(f"URL: {url}")
-        auth = (self.user, self.pw)
-        r = requests.get(url, auth=auth)
+            print(f"URL: {url}, PARAMS: {params}")
+        r = self.client.get(url, params=params)
         r.raise_for_status()
         with nostdout():
             response_json = r.json()
         if response_json["results"]:
             if self.config["debug"]:
                 print(f"ID: {response_json['results'][0]['id']}")
-            return response_json["results"][0]["id"]
+            self.page_ids[page_name] = response_json["results"][0]["id"]
+            return self.page_ids[page_name]
         else:
             if self.config["debug"]:
                 print("PAGE DOES NOT EXIST")
             return None
 
+    def find_page_ids(self, page_names):
+        # cached ids may come from an earlier build, resolving them again is a request per CQL_TITLE_LIMIT titles
+        names = [name for name in dict.fromkeys(page_names) if name]
+        if self.config["debug"]:
+            print(f"INFO    -   * Mkdocs With Confluence: Find Page IDs: {len(names)} PAGE NAMES")
+        url = self.config["host_url"] + "/search"
+        space = self.cql_quote(self.config["space"])
+        found = set()
+        # the results carry their ancestors, so they stand in for the descendant index of the main parent
+        if self.page_index is None:
+            self.page_index = {}
+        for i in range(0, len(names), CQL_TITLE_LIMIT):
+            chunk = names[i : i + CQL_TITLE_LIMIT]
+            titles = ", ".join(self.cql_quote(name) for name in chunk)
+            cql = f"space = {space} and type = page and title in ({titles})"
+            for result in self.get_paginated(url, {"cql": cql, "expand": "ancestors"}):
+                # CQL title matching is not strictly exact, keep only the titles that were asked for
+                if result["title"] in chunk:
+                    found.add(result["title"])
+                    self.index_page(result)
+        # titles not found are created during the build, there is no need to look them up one by one again
+        for name in names:
+            if name not in found:
+                self.forget_page(name)
+                self.missing_titles.add(name)
+        return {name: self.page_ids.get(name) for name in page_names}
+
+    def index_page(self, result):
+        main_parent = self.config["parent_page_name"] or self.config["space"]
+        self.page_ids[result["title"]] = result["id"]
+        if self.page_index is None:
+            return
+        if main_parent in [ancestor["title"] for ancestor in result["ancestors"]]:
+            self.page_index[result["title"]] = {"id": result["id"], "parent": result["ancestors"][-1]["title"]}
+        else:
+            self.page_index.pop(result["title"], None)
+
+    def forget_page(self, page_name):
+        self.page_ids.pop(page_name, None)
+        if self.page_index is not None:
+            self.page_index.pop(page_name, None)
+
+    def cql_quote(self, value):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
     def add_page(self, page_name, parent_page_id, page_content_in_storage_format):
         print(f"INFO    -   * Mkdocs With Confluence: {page_name} - *NEW PAGE*")
 
@@ -519,7 +855,6 @@ class MkdocsWithConfluence(BasePlugin):
         if self.config["debug"]:
             print(f"URL: {url}")
         headers = {"Content-Type": "application/json"}
-        auth = (self.user, self.pw)
         space = self.config["space"]
         data = {
             "type": "page",
@@ -531,28 +866,39 @@ class MkdocsWithConfluence(BasePlugin):
         if self.config["debug"]:
             print(f"DATA: {data}")
         if not self.dryrun:
-            r = requests.post(url, json=data, headers=headers, auth=auth)
+            r = self.client.post(url, json=data, headers=headers)
             r.raise_for_status()
             if r.status_code == 200:
+                with nostdout():
+                    self.page_ids[page_name] = r.json()["id"]
+                self.missing_titles.discard(page_name)
                 if self.config["debug"]:
                     print("OK!")
             else:
                 if self.config["debug"]:
                     print("ERR!")
 
-    def update_page(self, page_name, page_content_in_storage_format):
+    def update_page(self, page_name, page_content_in_storage_format, parent_page_name=None, page_version=None):
         page_id = self.find_page_id(page_name)
         print(f"INFO    -   * Mkdocs With Confluence: {page_name} - *UPDATE*")
         if self.config["debug"]:
             print(f" * Mkdocs With Confluence: Update PAGE ID: {page_id}, PAGE NAME: {page_name}")
         if page_id:
-            page_version = self.find_page_version(page_name)
+            if parent_page_name is not None:
+                parent_page_id = self.find_page_id(parent_page_name)
+                if not parent_page_id:
+                    print(f"ERR    - Mkdocs With Confluence: {page_name} - parent '{parent_page_name}' does not exist!")
+                    return
+            if page_version is None:
+                page_version = self.find_page_version(page_name)
+                if page_version is None:
+                    print(f"ERR    - Mkdocs With Confluence: {page_name} - page does not exist anymore!")
+                    return
             page_version = page_version + 1
             url = self.config["host_url"] + "/" + page_id
             if self.config["debug"]:
                 print(f"URL: {url}")
             headers = {"Content-Type": "application/json"}
-            auth = (self.user, self.pw)
             space = self.config["space"]
             data = {
                 "id": page_id,
@@ -562,9 +908,12 @@ class MkdocsWithConfluence(BasePlugin):
                 "body": {"storage": {"value": page_content_in_storage_format, "representation": "storage"}},
                 "version": {"number": page_version},
             }
+            if parent_page_name is not None:
+                print(f"INFO    -   * Mkdocs With Confluence: {page_name} - *MOVE* to {parent_page_name}")
+                data["ancestors"] = [{"id": parent_page_id}]
 
             if not self.dryrun:
-                r = requests.put(url, json=data, headers=headers, auth=auth)
+                r = self.client.put(url, json=data, headers=headers)
                 r.raise_for_status()
                 if r.status_code == 200:
                     if self.config["debug"]:
@@ -572,37 +921,134 @@ class MkdocsWithConfluence(BasePlugin):
                 else:
                     if self.config["debug"]:
                         print("ERR!")
+            if parent_page_name is not None:
+                self.get_page_index()[page_name] = {"id": page_id, "parent": parent_page_name}
         else:
             if self.config["debug"]:
                 print("PAGE DOES NOT EXIST YET!")
 
+    def move_page(self, page_name, parent_page_name):
+        page_id = self.find_page_id(page_name)
+        parent_page_id = self.find_page_id(parent_page_name)
+        if not page_id or not parent_page_id:
+            print(f"ERR    - Mkdocs With Confluence: Cannot move '{page_name}' to '{parent_page_name}'!")
+            return
+        print(f"INFO    -   * Mkdocs With Confluence: {page_name} - *MOVE* to {parent_page_name}")
+        url = self.config["host_url"] + "/" + page_id
+        if self.config["debug"]:
+            print(f"URL: {url}")
+        headers = {"Content-Type": "application/json"}
+        page_version = self.find_page_version(page_name)
+        if page_version is None:
+            print(f"ERR    - Mkdocs With Confluence: Cannot move '{page_name}', it does not exist anymore!")
+            return
+        # Confluence moves the whole subtree along with its root, so one update per moved section is enough
+        data = {
+            "id": page_id,
+            "title": page_name,
+            "type": "page",
+            "ancestors": [{"id": parent_page_id}],
+            "version": {"number": page_version + 1},
+        }
+        if self.config["debug"]:
+            print(f"DATA: {data}")
+        if not self.dryrun:
+            r = self.client.put(url, json=data, headers=headers)
+            r.raise_for_status()
+        self.get_page_index()[page_name] = {"id": page_id, "parent": parent_page_name}
+
+    def move_sections_if_needed(self, sections, main_parent):
+        # walk from the top of the nav down, so a moved section carries its subsections along before they are checked
+        chain = list(sections) + [main_parent]
+        for section, section_parent in reversed(list(zip(chain, chain[1:]))):
+            self.move_section_if_needed(section, section_parent)
+
+    def move_section_if_needed(self, section, section_parent):
+        if section == section_parent:
+            return
+        indexed = self.get_page_index().get(section)
+        if indexed is not None and indexed["parent"] != section_parent:
+            if self.config["debug"]:
+                print(f"DEBUG    - Section '{section}' moved: '{indexed['parent']}' -> '{section_parent}'")
+            self.move_page(section, section_parent)
+
+    def get_paginated(self, url, params):
+        # Confluence may cap the limit below the one requested, so follow its next links instead of counting
+        params = dict(params, limit=PAGE_LIMIT)
+        while url:
+            r = self.client.get(url, params=params)
+            r.raise_for_status()
+            with nostdout():
+                response_json = r.json()
+            yield from response_json["results"]
+            links = response_json.get("_links", {})
+            if "next" not in links:
+                break
+            url = links["base"] + links["next"] if "base" in links else urljoin(url, links["next"])
+            params = None
+
+    def get_page_index(self):
+        if self.page_index is None:
+            self.page_index = {}
+            main_parent = self.config["parent_page_name"] or self.config["space"]
+            main_parent_id = self.find_page_id(main_parent)
+            if main_parent_id:
+                if self.config["debug"]:
+                    print(f"DEBUG    - Loading page index below '{main_parent}'...")
+                url = self.config["host_url"] + "/" + main_parent_id + "/descendant/page"
+                for result in self.get_paginated(url, {"expand": "ancestors"}):
+                    self.index_page(result)
+        return self.page_index
+
+    def delete_page(self, page_id):
+        url = self.config["host_url"] + "/" + page_id
+        if self.config["debug"]:
+            print(f" * Mkdocs With Confluence: Delete PAGE ID: {page_id}")
+            print(f"URL: {url}")
+        r = self.client.delete(url)
+        r.raise_for_status()
+
+    def archive_pages(self, page_ids):
+        url = self.config["host_url"] + "/archive"
+        headers = {"Content-Type": "application/json"}
+        for i in range(0, len(page_ids), ARCHIVE_LIMIT):
+            data = {"pages": [{"id": page_id} for page_id in page_ids[i : i + ARCHIVE_LIMIT]]}
+            if self.config["debug"]:
+                print(f" * Mkdocs With Confluence: Archive Pages: {data}")
+                print(f"URL: {url}")
+            r = self.client.post(url, json=data, headers=headers)
+            r.raise_for_status()
+
     def find_page_version(self, page_name):
         if self.config["debug"]:
             print(f"INFO    -   * Mkdocs With Confluence: Find PAGE VERSION, PAGE NAME: {page_name}")
-        name_confl = page_name.replace(" ", "+")
-        url = self.config["host_url"] + "?title=" + name_confl + "&spaceKey=" + self.config["space"] + "&expand=version"
-        auth = (self.user, self.pw)
-        r = requests.get(url, auth=auth)
+        url = self.config["host_url"]
+        params = {"title": page_name, "spaceKey": self.config["space"], "expand": "version,ancestors"}
+        r = self.client.get(url, params=params)
         r.raise_for_status()
         with nostdout():
             response_json = r.json()
-        if response_json["results"] is not None:
+        if response_json["results"]:
             if self.config["debug"]:
                 print(f"VERSION: {response_json['results'][0]['version']['number']}")
+            self.index_page(response_json["results"][0])
             return response_json["results"][0]["version"]["number"]
         else:
             if self.config["debug"]:
                 print("PAGE DOES NOT EXISTS")
+            self.forget_page(page_name)
             return None
 
     def find_parent_name_of_page(self, name):
         if self.config["debug"]:
             print(f"INFO    -   * Mkdocs With Confluence: Find PARENT OF PAGE, PAGE NAME: {name}")
+        indexed = self.get_page_index().get(name)
+        if indexed is not None:
+            return indexed["parent"]
         idp = self.find_page_id(name)
-        url = self.config["host_url"] + "/" + idp + "?expand=ancestors"
+        url = self.config["host_url"] + "/" + idp
 
-        auth = (self.user, self.pw)
-        r = requests.get(url, auth=auth)
+        r = self.client.get(url, params={"expand": "ancestors"})
         r.raise_for_status()
         with nostdout():
             response_json = r.json()
@@ -0,0 +1,482 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+import yaml
+from mkdocs.commands.build import build
+from mkdocs.config import load_config
+
+from mkdocs_with_confluence import plugin
+from mkdocs_with_confluence.plugin import MkdocsWithConfluence
+
+HOST = "http://confluence"
+HOST_URL = HOST + "/rest/api/content"
+
+
+class FakeResponse(object):
+    def __init__(self, data=None, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+
+class FakeConfluence(object):
+    """In-memory stand-in for the Confluence REST API serving a single space."""
+
+    def __init__(self, pages, page_size=100):
+        # pages: {id: (title, parent id)}
+        self.pages = {
+            page_id: {"title": title, "parent": parent, "version": 1} for page_id, (title, parent) in pages.items()
+        }
+        self.page_size = page_size
+        self.calls = []
+        self.next_id = 1000
+
+    def request(self, method, url, params=None, json=None, **kwargs):
+        method = method.upper()
+        self.calls.append((method, url, params, json))
+        split = urlsplit(url)
+        params = dict(parse_qsl(split.query), **(params or {}))
+        path = [p for p in split.path[len("/rest/api/content") :].split("/") if p]
+        if method == "GET" and not path:
+            return self.results([self.page_json(i) for i, p in self.pages.items() if p["title"] == params["title"]])
+        if method == "GET" and path == ["search"]:
+            found = [self.page_json(i) for i, p in self.pages.items() if '"%s"' % p["title"] in params["cql"]]
+            return self.paginated(url, found, params)
+        if method == "GET" and path[1:] == ["descendant", "page"]:
+            return self.paginated(url, [self.page_json(i) for i in self.descendants(path[0])], params)
+        if method == "GET" and len(path) == 1:
+            return FakeResponse(self.page_json(path[0]))
+        if method == "POST" and not path:
+            if json["ancestors"][0]["id"] not in self.pages:
+                return FakeResponse({}, status_code=400)
+            page_id = str(self.next_id)
+            self.next_id += 1
+            self.pages[page_id] = {"title": json["title"], "parent": json["ancestors"][0]["id"], "version": 1}
+            return FakeResponse({"id": page_id})
+        if method == "POST" and path == ["archive"]:
+            for page in json["pages"]:
+                del self.pages[page["id"]]
+            return FakeResponse({})
+        if method == "PUT":
+            page = self.pages[path[0]]
+            page["version"] = json["version"]["number"]
+            if "ancestors" in json:
+                page["parent"] = json["ancestors"][0]["id"]
+            return FakeResponse({})
+        if method == "DELETE":
+            del self.pages[path[0]]
+            return FakeResponse(status_code=204)
+        raise AssertionError(f"unexpected request {method} {url}")
+
+    def results(self, results):
+        return FakeResponse({"results": results, "size": len(results)})
+
+    def paginated(self, url, results, params):
+        start = int(params.get("start", 0))
+        # like Confluence, cap the page size below the requested limit
+        limit = min(int(params["limit"]), self.page_size)
+        data = {"results": results[start : start + limit], "size": len(results[start : start + limit])}
+        data["_links"] = {"base": HOST}
+        if start + limit < len(results):
+            query = dict(params, start=start + limit, limit=limit)
+            data["_links"]["next"] = urlsplit(url).path + "?" + "&".join(f"{k}={v}" for k, v in query.items())
+        return FakeResponse(data)
+
+    def descendants(self, page_id):
+        for child_id, page in self.pages.items():
+            if page["parent"] == page_id:
+                yield child_id
+                yield from self.descendants(child_id)
+
+    def ancestors(self, page_id):
+        parent = self.pages[page_id]["parent"]
+        return self.ancestors(parent) + [{"id": parent, "title": self.pages[parent]["title"]}] if parent else []
+
+    def page_json(self, page_id):
+        page = self.pages[page_id]
+        return {
+            "id": page_id,
+            "title": page["title"],
+            "version": {"number": page["version"]},
+            "ancestors": self.ancestors(page_id),
+        }
+
+    def parent_title(self, title):
+        (page,) = [p for p in self.pages.values() if p["title"] == title]
+        return self.pages[page["parent"]]["title"]
+
+    def titles(self):
+        return {page["title"] for page in self.pages.values()}
+
+
+class ConfluenceTestCase(unittest.TestCase):
+    def confluence(self, pages, page_size=100):
+        """Serve all requests of the test from an in-memory Confluence holding the given pages."""
+        fake = FakeConfluence(pages, page_size)
+        # start without the clients, and their warm caches, of earlier tests
+        for patcher in (mock.patch.object(requests.Session, "request", fake.request), mock.patch.dict(plugin._clients)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        plugin._clients.clear()
+        return fake
+
+
+def plugin_config(**options):
+    config = dict(
+        host_url=HOST_URL,
+        space="DOCS",
+        parent_page_name="Root",
+        username="user",
+        password="secret",
+        enabled_if_env="MKDOCS_TO_CONFLUENCE",
+    )
+    config.update(options)
+    return config
+
+
+def make_plugin(**options):
+    confluence_plugin = MkdocsWithConfluence()
+    errors, warnings = confluence_plugin.load_config(plugin_config(**options))
+    assert not errors, errors
+    with mock.patch.dict(os.environ, {"MKDOCS_TO_CONFLUENCE": "1"}), mock.patch("sys.stdout"):
+        confluence_plugin.on_config(None)
+    return confluence_plugin
+
+
+def build_site(nav, docs, **options):
+    """Run a real MkDocs build of the given docs with the plugin enabled."""
+    site = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        for path, content in docs.items():
+            os.makedirs(os.path.dirname(os.path.join(site, "docs", path)), exist_ok=True)
+            with open(os.path.join(site, "docs", path), "w") as f:
+                f.write(content)
+        with open(os.path.join(site, "mkdocs.yml"), "w") as f:
+            yaml.safe_dump({"site_name": "Test", "nav": nav, "plugins": []}, f)
+        mkdocs_config = load_config(config_file=os.path.join(site, "mkdocs.yml"))
+        confluence_plugin = MkdocsWithConfluence()
+        confluence_plugin.load_config(plugin_config(**options))
+        mkdocs_config.plugins["mkdocs-with-confluence"] = confluence_plugin
+        # the plugin leaves copies of the rendered pages in the working directory
+        os.chdir(site)
+        patches = [
+            mock.patch.dict(os.environ, {"MKDOCS_TO_CONFLUENCE": "1"}),
+            mock.patch.object(plugin.time, "sleep"),
+            mock.patch.object(plugin, "sleep"),
+            mock.patch.object(MkdocsWithConfluence, "wait_until"),
+            mock.patch("sys.stdout"),
+        ]
+        with contextlib.ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            build(mkdocs_config)
+        return confluence_plugin
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(site)
+
+
+class TestPageMoves(ConfluenceTestCase):
+    def test_paginated_index_follows_next_links(self):
+        pages = {"1": ("Root", None)}
+        pages.update({str(i): (f"Page {i}", "1") for i in range(2, 9)})
+        self.confluence(pages, page_size=3)
+        confluence_plugin = make_plugin()
+
+        index = confluence_plugin.get_page_index()
+
+        self.assertEqual(set(index), {f"Page {i}" for i in range(2, 9)})
+
+    def test_page_under_another_section_is_moved_with_its_update(self):
+        fake = self.confluence({"1": ("Root", None), "2": ("S1", "1"), "3": ("S2", "1"), "4": ("Leaf", "2")})
+
+        build_site([{"S2": [{"Leaf": "leaf.md"}]}], {"leaf.md": "# Leaf\n"})
+
+        self.assertEqual(fake.parent_title("Leaf"), "S2")
+        puts = [call for call in fake.calls if call[0] == "PUT"]
+        self.assertEqual(len(puts), 1)
+        self.assertEqual(puts[0][1], HOST_URL + "/4")
+        self.assertIn("body", puts[0][3])
+        self.assertEqual(puts[0][3]["ancestors"], [{"id": "3"}])
+        self.assertEqual([call for call in fake.calls if call[0] == "POST"], [])
+
+    def test_section_holding_only_subsections_is_moved(self):
+        fake = self.confluence(
+            {
+                "1": ("Root", None),
+                "2": ("X", "1"),
+                "3": ("Y", "1"),
+                "4": ("A", "2"),
+                "5": ("B", "4"),
+                "6": ("Page", "5"),
+            }
+        )
+        nav = [{"Y": [{"A": [{"B": [{"Page": "page.md"}, {"Other Page": "other.md"}]}]}]}]
+
+        build_site(nav, {"page.md": "# Page\n", "other.md": "# Other Page\n"})
+
+        self.assertEqual(fake.parent_title("A"), "Y")
+        self.assertEqual(fake.parent_title("B"), "A")
+        self.assertEqual(fake.parent_title("Page"), "B")
+        self.assertEqual(fake.parent_title("Other Page"), "B")
+        moves = [call for call in fake.calls if call[0] == "PUT" and "body" not in call[3]]
+        self.assertEqual([call[1] for call in moves], [HOST_URL + "/4"])
+
+
+class TestCleanupOrphans(ConfluenceTestCase):
+    def orphans_plugin(self, count, **options):
+        pages = {"1": ("Root", None), "2": ("Kept", "1")}
+        pages.update({str(i): (f"Orphan {i}", "1") for i in range(10, 10 + count)})
+        self.fake = self.confluence(pages)
+        confluence_plugin = make_plugin(cleanup_orphans=True, **options)
+        confluence_plugin.kept_titles = {"Kept", "Root"}
+        return confluence_plugin
+
+    def test_nav_pages_survive_cleanup(self):
+        fake = self.confluence({"1": ("Root", None), "2": ("Old Page", "1")})
+        docs = {"index.md": "# Home Page\n", "sub/foo.md": "# Foo & Bar\n", "sub/t.md": "# T\n"}
+        nav = ["index.md", {"Sec": ["sub/foo.md", {"Titled One": "sub/t.md"}]}]
+
+        build_site(nav, docs, cleanup_orphans=True)
+
+        self.assertEqual(fake.titles(), {"Root", "Home Page", "Sec", "Foo & Bar", "Titled One"})
+        self.assertEqual(len(fake.pages), 5)
+        self.assertEqual(fake.parent_title("Titled One"), "Sec")
+
+    @mock.patch("sys.stdout")
+    def test_refuses_without_published_pages(self, stdout):
+        confluence_plugin = self.orphans_plugin(1)
+        confluence_plugin.kept_titles = set()
+
+        confluence_plugin.cleanup_orphans()
+
+        self.assertEqual(len(self.fake.pages), 3)
+        self.assertEqual(self.fake.calls, [])
+
+    @mock.patch("sys.stdout")
+    def test_refuses_above_max_deletions(self, stdout):
+        confluence_plugin = self.orphans_plugin(3, cleanup_max_deletions=2)
+
+        confluence_plugin.cleanup_orphans()
+
+        self.assertEqual(len(self.fake.pages), 5)
+        self.assertEqual([call for call in self.fake.calls if call[0] != "GET"], [])
+
+    @mock.patch("sys.stdout")
+    def test_dryrun_only_lists(self, stdout):
+        confluence_plugin = self.orphans_plugin(2, dryrun=True)
+
+        confluence_plugin.cleanup_orphans()
+
+        self.assertEqual(len(self.fake.pages), 4)
+        self.assertEqual([call for call in self.fake.calls if call[0] != "GET"], [])
+        printed = "".join(call.args[0] for call in stdout.write.call_args_list)
+        self.assertIn("Orphan 10 *ORPHAN* (delete)", printed)
+        self.assertIn("Orphan 11 *ORPHAN* (delete)", printed)
+
+    @mock.patch("sys.stdout")
+    def test_deletes_orphans_only(self, stdout):
+        confluence_plugin = self.orphans_plugin(3)
+
+        confluence_plugin.cleanup_orphans()
+
+        self.assertEqual(self.fake.titles(), {"Root", "Kept"})
+        self.assertEqual(len([call for call in self.fake.calls if call[0] == "DELETE"]), 3)
+
+    @mock.patch("sys.stdout")
+    @mock.patch.object(plugin, "ARCHIVE_LIMIT", 2)
+    def test_archive_chunks_at_archive_limit(self, stdout):
+        confluence_plugin = self.orphans_plugin(5, cleanup_action="archive")
+
+        confluence_plugin.cleanup_orphans()
+
+        archived = [call[3]["pages"] for call in self.fake.calls if call[0] == "POST"]
+        self.assertEqual([len(pages) for pages in archived], [2, 2, 1])
+        self.assertEqual(self.fake.titles(), {"Root", "Kept"})
+
+
+@mock.patch("sys.stdout")
+class TestTitleLookups(ConfluenceTestCase):
+    def test_titles_are_sent_as_query_params(self, stdout):
+        title = 'Q&A #1? "ünï"'
+        fake = self.confluence({"1": ("Root", None), "2": (title, "1")})
+        confluence_plugin = make_plugin()
+
+        self.assertEqual(confluence_plugin.find_page_id(title), "2")
+        self.assertEqual(fake.calls[0][2]["title"], title)
+
+    def test_nav_titles_are_resolved_in_bulk(self, stdout):
+        fake = self.confluence({"1": ("Root", None), "2": ("Sec A", "1"), "3": ("Alpha", "2")})
+        docs = {"a.md": "# Alpha\n", "b.md": "# Beta\n"}
+        nav = [{"Sec A": [{"Alpha": "a.md"}]}, {"Sec B": ["b.md"]}]
+
+        build_site(nav, docs)
+
+        method, url, params, data = fake.calls[0]
+        self.assertEqual(url, HOST_URL + "/search")
+        for title in ("Sec A", "Alpha", "Sec B", "Root"):
+            self.assertIn(f'"{title}"', params["cql"])
+        # found titles come with their parents and missing ones are remembered, only the page titled
+        # by its markdown is looked up on its own
+        id_lookups = [call[2]["title"] for call in fake.calls if call[2] and call[2].get("expand") == "history"]
+        self.assertEqual(id_lookups, ["Beta"])
+        self.assertEqual([call for call in fake.calls if "/descendant/" in call[1]], [])
+        self.assertEqual(fake.titles(), {"Root", "Sec A", "Alpha", "Sec B", "Beta"})
+        self.assertEqual(fake.parent_title("Beta"), "Sec B")
+
+    def test_disabled_without_enabled_if_env(self, stdout):
+        fake = self.confluence({"1": ("Root", None)})
+
+        confluence_plugin = build_site(["index.md"], {"index.md": "# Home\n"}, enabled_if_env=None)
+
+        self.assertFalse(confluence_plugin.enabled)
+        self.assertEqual(fake.calls, [])
+
+
+@mock.patch("sys.stdout")
+class TestPipeline(ConfluenceTestCase):
+    def blocked_plugin(self):
+        self.confluence({"1": ("Root", None)})
+        confluence_plugin = make_plugin(pipeline=True, pipeline_memory_budget=0)
+        self.released = threading.Event()
+        self.published = []
+
+        def publish_page(page_title, parent, parent1, main_parent, confluence_body, attachments, ancestors=()):
+            self.released.wait(5)
+            self.published.append((page_title, confluence_body))
+
+        confluence_plugin.publish_page = publish_page
+        return confluence_plugin
+
+    def test_pages_spooled_to_disk_are_published_in_nav_order(self, stdout):
+        confluence_plugin = self.blocked_plugin()
+
+        for i in range(3):
+            confluence_plugin.spool_page(f"Page {i}", "Root", "Root", "Root", f"<p>{i}</p>", [], [])
+        spool_dir = confluence_plugin.spool_dir
+        # the uploader is held on the first page, the others must be waiting on disk
+        self.assertTrue({"1.html.gz", "2.html.gz"} <= set(os.listdir(spool_dir)))
+        self.released.set()
+        confluence_plugin.on_post_build(None)
+
+        self.assertEqual(self.published, [(f"Page {i}", f"<p>{i}</p>") for i in range(3)])
+        self.assertFalse(os.path.exists(spool_dir))
+        self.assertEqual(confluence_plugin.spool_size, 0)
+
+    def test_build_error_removes_spool(self, stdout):
+        confluence_plugin = self.blocked_plugin()
+
+        for i in range(3):
+            confluence_plugin.spool_page(f"Page {i}", "Root", "Root", "Root", f"<p>{i}</p>", [], [])
+        spool_dir = confluence_plugin.spool_dir
+        threading.Timer(0.1, self.released.set).start()
+        confluence_plugin.on_build_error(RuntimeError())
+
+        self.assertFalse(os.path.exists(spool_dir))
+        self.assertEqual(len(confluence_plugin.spool), 0)
+        self.assertLess(len(self.published), 3)
+
+    def test_uploader_error_stops_spooling(self, stdout):
+        self.confluence({"1": ("Root", None)})
+        confluence_plugin = make_plugin(pipeline=True, pipeline_memory_budget=0)
+        confluence_plugin.publish_page = mock.Mock(side_effect=RuntimeError("upload failed"))
+
+        confluence_plugin.spool_page("Page 0", "Root", "Root", "Root", "<p>0</p>", [], [])
+        confluence_plugin.uploader.join(5)
+        with self.assertRaisesRegex(RuntimeError, "upload failed"):
+            confluence_plugin.spool_page("Page 1", "Root", "Root", "Root", "<p>1</p>", [], [])
+        spool_dir = confluence_plugin.spool_dir
+        confluence_plugin.on_build_error(RuntimeError())
+
+        self.assertEqual(confluence_plugin.publish_page.call_count, 1)
+        self.assertEqual(len(confluence_plugin.spool), 0)
+        self.assertFalse(os.path.exists(spool_dir))
+
+    @mock.patch.object(plugin.shutil, "copy", side_effect=AssertionError("page copied"))
+    @mock.patch.object(plugin.tempfile, "NamedTemporaryFile", side_effect=AssertionError("temporary file written"))
+    def test_build_publishes_through_the_spool(self, named_temporary_file, copy, stdout):
+        fake = self.confluence({"1": ("Root", None)})
+        docs = {"index.md": "# Home Page\n", "sub/foo.md": "# Foo\n"}
+        nav = ["index.md", {"Sec": ["sub/foo.md"]}]
+
+        confluence_plugin = build_site(nav, docs, pipeline=True, pipeline_memory_budget=0)
+
+        self.assertEqual(fake.titles(), {"Root", "Home Page", "Sec", "Foo"})
+        self.assertEqual(len(fake.pages), 4)
+        self.assertEqual(fake.parent_title("Foo"), "Sec")
+        self.assertIsNone(confluence_plugin.spool_dir)
+        self.assertEqual(confluence_plugin.spool_size, 0)
+
+
+@mock.patch("sys.stdout")
+class TestSharedClient(ConfluenceTestCase):
+    def test_strictest_rate_limit_wins(self, stdout):
+        self.confluence({})
+        client = plugin.get_client(HOST_URL, "user", "secret", 5)
+
+        self.assertIs(plugin.get_client(HOST_URL, "user", "secret", 0), client)
+        self.assertIs(plugin.get_client(HOST_URL, "user", "secret", 10), client)
+        self.assertEqual(client.rate_limit, 5)
+        plugin.get_client(HOST_URL, "user", "secret", 2)
+        self.assertEqual(client.rate_limit, 2)
+        self.assertIsNot(plugin.get_client(HOST_URL, "other", "secret", 2), client)
+
+    def test_second_build_reuses_client_and_caches(self, stdout):
+        fake = self.confluence({"1": ("Root", None)})
+        docs = {"index.md": "# Home Page\n", "sub/foo.md": "# Foo\n"}
+        nav = ["index.md", {"Sec": ["sub/foo.md"]}]
+
+        first = build_site(nav, docs)
+        del fake.calls[:]
+        second = build_site(nav, docs)
+
+        self.assertIs(second.client, first.client)
+        # pages titled by their markdown are known from the first build, only their versions are looked up
+        id_lookups = [call for call in fake.calls if call[2] and call[2].get("expand") == "history"]
+        self.assertEqual(id_lookups, [])
+        self.assertEqual([call[0] for call in fake.calls if call[0] != "GET"], ["PUT", "PUT"])
+        self.assertEqual(len(fake.pages), 4)
+
+    def test_page_deleted_between_builds_is_recreated(self, stdout):
+        fake = self.confluence({"1": ("Root", None)})
+        docs = {"index.md": "# Home Page\n"}
+
+        build_site(["index.md"], docs)
+        (page_id,) = [page_id for page_id, page in fake.pages.items() if page["title"] == "Home Page"]
+        del fake.pages[page_id]
+        build_site(["index.md"], docs)
+
+        self.assertEqual(fake.titles(), {"Root", "Home Page"})
+        self.assertEqual(len(fake.pages), 2)
+
+    def test_page_moved_between_builds_is_moved_back(self, stdout):
+        fake = self.confluence({"1": ("Root", None)})
+        docs = {"index.md": "# Home Page\n", "sub/foo.md": "# Foo\n"}
+        nav = ["index.md", {"Sec": ["sub/foo.md"]}]
+
+        # the cleanup leaves an index of the whole tree in the cache, with Foo under Sec
+        build_site(nav, docs, cleanup_orphans=True)
+        (page_id,) = [page_id for page_id, page in fake.pages.items() if page["title"] == "Foo"]
+        fake.pages[page_id]["parent"] = "1"
+        build_site(nav, docs)
+
+        self.assertEqual(fake.parent_title("Foo"), "Sec")
+        self.assertEqual(len(fake.pages), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()